@@ -51,14 +51,7 @@ def send(ctx, file_path, onion_address, port, password):
     click.echo(f"Sending {file_path} to {onion_address}:{port}")
     
     if password:
-        # Encrypt file before sending
-        encrypted_path = f"{file_path}.encrypted"
-        if ctx.obj['encryptor'].encrypt_file(file_path, encrypted_path, password):
-            file_path = encrypted_path
-            click.echo("File encrypted")
-        else:
-            click.echo("Failed to encrypt file")
-            return
+        click.echo("File will be encrypted while sending")
     
     if ctx.obj['transfer'].send_file(file_path, onion_address, port, password):
         click.echo("✓ File sent successfully")
@@ -68,8 +61,9 @@ def send(ctx, file_path, onion_address, port, password):
 @cli.command()
 @click.argument('port', type=int)
 @click.option('--download-dir', default='./downloads', help='Download directory')
+@click.option('--password', help='Decrypt encrypted files while receiving')
 @click.pass_context
-def receive(ctx, port, download_dir):
+def receive(ctx, port, download_dir, password):
     """Start receiving files on specified port"""
     # Ensure Tor is running
     if not ctx.obj['tor_client'].start_tor():
@@ -80,12 +74,13 @@ def receive(ctx, port, download_dir):
     
     def on_file_received(file_path, metadata):
         click.echo(f"✓ File received: {file_path}")
-        if metadata.get('encrypted'):
+        if metadata.get('encrypted') and not metadata.get('decrypted'):
             click.echo("File is encrypted. Use 'decrypt' command to decrypt.")
     
     click.echo(f"Listening on port {port}. Press Ctrl+C to stop.")
     try:
-        ctx.obj['transfer'].start_receiver(port, download_dir, on_file_received)
+        ctx.obj['transfer'].start_receiver(port, download_dir, on_file_received,
+                                           password)
     except KeyboardInterrupt:
         click.echo("\nStopped listening")
 
@@ -100,11 +95,7 @@ def decrypt(ctx, file_path, password, output):
         output = file_path.replace('.encrypted', '')
     
     if ctx.obj['encryptor'].decrypt_file(file_path, output, password):
-        click.echo(f"✓ File decrypted: {output}")
-        
-        # Verify checksum
-        checksum = ctx.obj['encryptor'].calculate_checksum(output)
-        click.echo(f"File checksum: {checksum}")
+        click.echo(f"✓ File decrypted and authenticated: {output}")
     else:
         click.echo("✗ Decryption failed")
 
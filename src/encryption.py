@@ -1,61 +1,100 @@
 import os
+import atexit
 import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import hashes, padding
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.backends import default_backend
+from cryptography.exceptions import InvalidTag
 import base64
 
+from .utils import file_sha256
+
+SALT_SIZE = 16
+IV_SIZE = 12  # 96-bit nonce recommended for GCM
+TAG_SIZE = 16
+BUFFER_SIZE = 1024 * 1024
+PBKDF2_ITERATIONS = 100000
+KEY_CACHE_SIZE = 32
+
+# Derived keys keyed by (sha256(password), salt), most recently used last
+_key_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+_key_cache_lock = threading.Lock()
+
+def clear_key_cache():
+    """Drop all cached derived keys"""
+    with _key_cache_lock:
+        _key_cache.clear()
+
+# Don't let keys linger until interpreter teardown
+atexit.register(clear_key_cache)
+
 class FileEncryptor:
     def __init__(self):
         self.backend = default_backend()
     
     def derive_key(self, password: str, salt: bytes) -> bytes:
-        """Derive encryption key from password using PBKDF2"""
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-            backend=self.backend
-        )
-        return kdf.derive(password.encode())
+        """Derive encryption key from password using PBKDF2-HMAC-SHA256
+        
+        Results are cached per (password, salt) so repeated operations on
+        files from the same sender don't rerun the KDF.
+        """
+        cache_key = (hashlib.sha256(password.encode()).digest(), bytes(salt))
+        with _key_cache_lock:
+            key = _key_cache.get(cache_key)
+            if key is not None:
+                _key_cache.move_to_end(cache_key)
+                return key
+        
+        # hashlib runs the whole iteration loop in C with the GIL released
+        key = hashlib.pbkdf2_hmac('sha256', password.encode(), salt,
+                                  PBKDF2_ITERATIONS, 32)
+        
+        with _key_cache_lock:
+            _key_cache[cache_key] = key
+            if len(_key_cache) > KEY_CACHE_SIZE:
+                _key_cache.popitem(last=False)
+        return key
+    
+    def create_encryptor(self, key: bytes, iv: bytes):
+        """Create streaming AES-256-GCM encryption context"""
+        cipher = Cipher(algorithms.AES(key), modes.GCM(iv), backend=self.backend)
+        return cipher.encryptor()
+    
+    def create_decryptor(self, key: bytes, iv: bytes):
+        """Create streaming AES-256-GCM decryption context"""
+        cipher = Cipher(algorithms.AES(key), modes.GCM(iv), backend=self.backend)
+        return cipher.decryptor()
     
     def encrypt_file(self, input_path: str, output_path: str, password: str) -> bool:
-        """Encrypt file with AES-256-CBC"""
+        """Encrypt file with AES-256-GCM
+        
+        Output layout is salt || iv || ciphertext || tag.
+        """
         try:
             # Generate random salt and IV
-            salt = os.urandom(16)
-            iv = os.urandom(16)
+            salt = os.urandom(SALT_SIZE)
+            iv = os.urandom(IV_SIZE)
             
             # Derive key
             key = self.derive_key(password, salt)
             
             # Create cipher
-            cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=self.backend)
+            cipher = Cipher(algorithms.AES(key), modes.GCM(iv), backend=self.backend)
             encryptor = cipher.encryptor()
             
-            # Pad data
-            padder = padding.PKCS7(128).padder()
-            
             with open(input_path, 'rb') as infile, open(output_path, 'wb') as outfile:
                 # Write salt and IV
                 outfile.write(salt)
                 outfile.write(iv)
                 
                 # Encrypt file in chunks
-                while True:
-                    chunk = infile.read(8192)
-                    if len(chunk) == 0:
-                        break
-                    padded_chunk = padder.update(chunk)
-                    encrypted_chunk = encryptor.update(padded_chunk)
-                    outfile.write(encrypted_chunk)
+                self._stream(encryptor, infile, outfile)
                 
-                # Finalize
-                final_padded = padder.finalize()
-                final_encrypted = encryptor.update(final_padded) + encryptor.finalize()
-                outfile.write(final_encrypted)
+                # Finalize and append authentication tag
+                encryptor.finalize()
+                outfile.write(encryptor.tag)
             
             return True
             
@@ -64,48 +103,78 @@ class FileEncryptor:
             return False
     
     def decrypt_file(self, input_path: str, output_path: str, password: str) -> bool:
-        """Decrypt file with AES-256-CBC"""
+        """Decrypt and authenticate file with AES-256-GCM"""
+        output_opened = False
+        verified = False
         try:
             with open(input_path, 'rb') as infile:
                 # Read salt and IV
-                salt = infile.read(16)
-                iv = infile.read(16)
+                salt = infile.read(SALT_SIZE)
+                iv = infile.read(IV_SIZE)
+                
+                # Read trailing authentication tag
+                infile.seek(-TAG_SIZE, os.SEEK_END)
+                tag = infile.read(TAG_SIZE)
+                remaining = infile.tell() - TAG_SIZE - SALT_SIZE - IV_SIZE
+                if remaining < 0:
+                    raise ValueError("file is too short to be encrypted")
+                infile.seek(SALT_SIZE + IV_SIZE)
                 
                 # Derive key
                 key = self.derive_key(password, salt)
                 
                 # Create cipher
-                cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=self.backend)
+                cipher = Cipher(algorithms.AES(key), modes.GCM(iv), backend=self.backend)
                 decryptor = cipher.decryptor()
                 
-                # Unpad data
-                unpadder = padding.PKCS7(128).unpadder()
-                
                 with open(output_path, 'wb') as outfile:
+                    output_opened = True
+                    
                     # Decrypt file in chunks
-                    while True:
-                        chunk = infile.read(8192)
-                        if len(chunk) == 0:
-                            break
-                        decrypted_chunk = decryptor.update(chunk)
-                        unpadded_chunk = unpadder.update(decrypted_chunk)
-                        outfile.write(unpadded_chunk)
+                    self._stream(decryptor, infile, outfile, remaining)
                     
-                    # Finalize
-                    final_decrypted = decryptor.finalize()
-                    final_unpadded = unpadder.update(final_decrypted) + unpadder.finalize()
-                    outfile.write(final_unpadded)
+                    # Finalize and verify tag
+                    decryptor.finalize_with_tag(tag)
             
+            verified = True
             return True
             
+        except InvalidTag:
+            print("Decryption error: authentication failed (wrong password or corrupted file)")
+            return False
         except Exception as e:
             print(f"Decryption error: {e}")
             return False
+        finally:
+            # Never leave unauthenticated plaintext behind, including after
+            # write errors or interrupts
+            if output_opened and not verified and os.path.exists(output_path):
+                os.remove(output_path)
+    
+    def _stream(self, context, infile, outfile, length: Optional[int] = None):
+        """Feed infile through a cipher context into outfile
+        
+        Both buffers are allocated once and reused, so bulk data goes
+        straight from readinto() to OpenSSL without per-chunk allocations.
+        Reads until EOF, or exactly `length` bytes when given.
+        """
+        in_buf = bytearray(BUFFER_SIZE)
+        in_mv = memoryview(in_buf)
+        out_buf = bytearray(BUFFER_SIZE + 15)
+        out_mv = memoryview(out_buf)
+        
+        while length is None or length > 0:
+            want = BUFFER_SIZE if length is None else min(BUFFER_SIZE, length)
+            n = infile.readinto(in_mv[:want])
+            if not n:
+                if length is not None:
+                    raise ValueError("unexpected end of file")
+                break
+            if length is not None:
+                length -= n
+            outlen = context.update_into(in_mv[:n], out_buf)
+            outfile.write(out_mv[:outlen])
     
     def calculate_checksum(self, file_path: str) -> str:
         """Calculate SHA-256 checksum of file"""
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
-        return sha256_hash.hexdigest()
+        return file_sha256(file_path)
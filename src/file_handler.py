@@ -1,24 +1,32 @@
 import os
+import sys
+import errno
+import mmap
 import json
-import hashlib
 from typing import Dict, List, Optional
 from dataclasses import dataclass
 from tqdm import tqdm
 
+from .utils import file_sha256
+
+MAX_CACHED_MMAPS = 16
+
 @dataclass
 class FileMetadata:
     filename: str
     filesize: int
     chunks: int
-    checksum: str
+    checksum: Optional[str]
     chunk_size: int = 1024 * 1024  # 1MB chunks
     encrypted: bool = False
 
 class FileHandler:
     def __init__(self, chunk_size: int = 1024 * 1024):
         self.chunk_size = chunk_size
+        self._mmaps: Dict[str, tuple] = {}
     
-    def get_file_metadata(self, file_path: str) -> Optional[FileMetadata]:
+    def get_file_metadata(self, file_path: str,
+                          with_checksum: bool = True) -> Optional[FileMetadata]:
         """Get metadata for file including chunk information"""
         try:
             if not os.path.exists(file_path):
@@ -28,7 +36,7 @@ class FileHandler:
             chunks = (filesize + self.chunk_size - 1) // self.chunk_size
             
             # Calculate checksum
-            checksum = self._calculate_checksum(file_path)
+            checksum = self._calculate_checksum(file_path) if with_checksum else None
             
             return FileMetadata(
                 filename=os.path.basename(file_path),
@@ -43,35 +51,113 @@ class FileHandler:
     
     def _calculate_checksum(self, file_path: str) -> str:
         """Calculate SHA-256 checksum"""
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
-        return sha256_hash.hexdigest()
+        return file_sha256(file_path)
     
-    def read_chunk(self, file_path: str, chunk_index: int) -> Optional[bytes]:
-        """Read specific chunk from file"""
+    def read_chunk(self, file_path: str, chunk_index: int) -> Optional[memoryview]:
+        """Read specific chunk from file
+        
+        Returns a zero-copy view into a cached read-only mapping of the file.
+        The mapping is refreshed when the file changes on disk.
+        """
         try:
-            with open(file_path, 'rb') as f:
-                f.seek(chunk_index * self.chunk_size)
-                chunk_data = f.read(self.chunk_size)
-                return chunk_data
+            mapping = self._get_mmap(file_path)
+            if mapping is None:
+                return memoryview(b'')
+            
+            offset = chunk_index * self.chunk_size
+            return memoryview(mapping)[offset:offset + self.chunk_size]
         except Exception as e:
             print(f"Error reading chunk {chunk_index}: {e}")
             return None
     
-    def write_chunk(self, file_path: str, chunk_index: int, data: bytes) -> bool:
-        """Write chunk to file at specific position"""
+    def _get_mmap(self, file_path: str) -> Optional[mmap.mmap]:
+        """Map file read-only and reuse the mapping while the file is unchanged"""
+        st = os.stat(file_path)
+        signature = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        cached = self._mmaps.get(file_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        
+        # File is new or has been modified since it was mapped
+        if cached is not None:
+            self._release_mmap(self._mmaps.pop(file_path)[1])
+        elif len(self._mmaps) >= MAX_CACHED_MMAPS:
+            # Evict the least recently mapped file
+            oldest = next(iter(self._mmaps))
+            self._release_mmap(self._mmaps.pop(oldest)[1])
+        
+        with open(file_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            signature = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+            if st.st_size == 0:
+                mapping = None  # Empty files cannot be mapped
+            else:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(mapping, 'madvise'):
+                    # Chunks are mostly read in order; let the kernel prefetch
+                    mapping.madvise(mmap.MADV_SEQUENTIAL)
+        self._mmaps[file_path] = (signature, mapping)
+        return mapping
+    
+    def _release_mmap(self, mapping: Optional[mmap.mmap]):
+        """Close mapping unless views returned by read_chunk still use it"""
+        if mapping is None:
+            return
+        try:
+            mapping.close()
+        except BufferError:
+            pass  # Unmapped once the last view is released
+    
+    def close(self):
+        """Release cached file mappings"""
+        try:
+            for _, mapping in self._mmaps.values():
+                self._release_mmap(mapping)
+        finally:
+            self._mmaps.clear()
+    
+    def open_output(self, file_path: str, filesize: int) -> Optional[int]:
+        """Create output file of the final size and return its descriptor"""
         try:
             # Ensure directory exists
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
             
-            with open(file_path, 'ab' if chunk_index > 0 else 'wb') as f:
-                if chunk_index > 0:
-                    # Seek to position for writing
-                    f.seek(chunk_index * self.chunk_size)
-                f.write(data)
-                f.flush()
+            fd = os.open(file_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                self._preallocate(fd, filesize)
+            except OSError:
+                # e.g. out of space: refuse now rather than mid-transfer
+                os.close(fd)
+                os.remove(file_path)
+                raise
+            return fd
+        except Exception as e:
+            print(f"Error opening {file_path}: {e}")
+            return None
+    
+    def _preallocate(self, fd: int, filesize: int):
+        """Reserve contiguous disk space for the whole file up front"""
+        if filesize > 0 and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, filesize)
+                return
+            except OSError as e:
+                # Only fall back when the filesystem can't preallocate;
+                # anything else (notably ENOSPC) must reach the caller
+                if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS):
+                    raise
+        os.ftruncate(fd, filesize)
+    
+    def write_chunk(self, fd: int, chunk_index: int, data: bytes,
+                    base_offset: int = 0) -> bool:
+        """Write chunk to file descriptor at its position"""
+        try:
+            offset = base_offset + chunk_index * self.chunk_size
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
             
             return True
         except Exception as e:
@@ -80,16 +166,25 @@ class FileHandler:
     
     def get_missing_chunks(self, file_path: str, total_chunks: int) -> List[int]:
         """Get list of chunks that need to be downloaded"""
+        total_size = os.path.getsize(file_path) if os.path.exists(file_path) else None
+        
+        # Stat all chunk files in one directory pass
+        chunk_dir = os.path.dirname(file_path) or '.'
+        prefix = f"{os.path.basename(file_path)}.chunk"
+        try:
+            with os.scandir(chunk_dir) as entries:
+                chunk_sizes = {entry.name: entry.stat().st_size
+                               for entry in entries if entry.name.startswith(prefix)}
+        except FileNotFoundError:
+            chunk_sizes = {}
+        
         missing_chunks = []
         for i in range(total_chunks):
             # Check if chunk exists and has correct size
-            expected_size = min(self.chunk_size, 
-                              os.path.getsize(file_path) - i * self.chunk_size) \
-                          if os.path.exists(file_path) else self.chunk_size
+            expected_size = min(self.chunk_size, total_size - i * self.chunk_size) \
+                          if total_size is not None else self.chunk_size
             
-            chunk_path = f"{file_path}.chunk{i}"
-            if not os.path.exists(chunk_path) or \
-               os.path.getsize(chunk_path) != expected_size:
+            if chunk_sizes.get(f"{prefix}{i}") != expected_size:
                 missing_chunks.append(i)
         
         return missing_chunks
@@ -97,17 +192,38 @@ class FileHandler:
     def reassemble_file(self, temp_dir: str, output_path: str, total_chunks: int) -> bool:
         """Reassemble file from chunks"""
         try:
-            with open(output_path, 'wb') as outfile:
+            out_fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
                 for i in tqdm(range(total_chunks), desc="Reassembling"):
                     chunk_path = os.path.join(temp_dir, f"chunk{i}")
                     if os.path.exists(chunk_path):
-                        with open(chunk_path, 'rb') as infile:
-                            outfile.write(infile.read())
-                        os.remove(chunk_path)  # Clean up chunk
+                        in_fd = os.open(chunk_path, os.O_RDONLY)
+                        try:
+                            self._copy_fd(in_fd, out_fd, os.fstat(in_fd).st_size)
+                        finally:
+                            os.close(in_fd)
+                        os.unlink(chunk_path)  # Clean up chunk
                     else:
                         print(f"Missing chunk {i}")
                         return False
+            finally:
+                os.close(out_fd)
             return True
         except Exception as e:
             print(f"Error reassembling file: {e}")
             return False
+    
+    def _copy_fd(self, in_fd: int, out_fd: int, size: int):
+        """Append size bytes from in_fd to out_fd"""
+        offset = 0
+        while offset < size:
+            if sys.platform.startswith('linux'):
+                # Kernel-space copy, data never enters Python memory
+                copied = os.sendfile(out_fd, in_fd, offset, size - offset)
+            else:
+                # sendfile() only targets sockets elsewhere
+                data = os.pread(in_fd, min(self.chunk_size, size - offset), offset)
+                copied = os.write(out_fd, data) if data else 0
+            if copied == 0:
+                raise IOError("chunk file truncated during copy")
+            offset += copied
@@ -88,6 +88,8 @@ class TorClient:
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.settimeout(30)
+            # Don't let Nagle hold back small control messages
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             sock.connect(('127.0.0.1', self.tor_port))
             return sock
         except Exception as e:
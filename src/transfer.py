@@ -1,30 +1,58 @@
+import os
+import asyncio
 import socket
-import json
+import struct
 import time
-import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Callable
+import orjson
 from tqdm import tqdm
+from cryptography.exceptions import InvalidTag
 
+from .encryption import FileEncryptor, SALT_SIZE, IV_SIZE, TAG_SIZE
 from .file_handler import FileHandler, FileMetadata
 from .tor_client import TorClient
 
+# Chunk frame header: index, payload size, flags
+CHUNK_HEADER = struct.Struct('<QII')
+FLAG_FINAL = 0x1
+FLAG_TAG = 0x2
+
+WORKER_THREADS = 4
+WRITE_QUEUE_SIZE = 16
+
 class P2PTransfer:
     def __init__(self, tor_client: TorClient):
         self.tor_client = tor_client
         self.file_handler = FileHandler()
+        self.encryptor = FileEncryptor()
         self.is_listening = False
         self.current_transfers = {}
     
     def send_file(self, file_path: str, target_onion: str, target_port: int, 
                   password: Optional[str] = None) -> bool:
-        """Send file to target onion address"""
+        """Send file to target onion address
+        
+        With a password the file is encrypted on the fly while it is sent.
+        """
         try:
-            # Get file metadata
-            metadata = self.file_handler.get_file_metadata(file_path)
+            # Get file metadata; encrypted transfers are authenticated by the
+            # GCM tag so they skip the separate checksum pass
+            metadata = self.file_handler.get_file_metadata(
+                file_path, with_checksum=password is None)
             if not metadata:
                 print("Failed to get file metadata")
                 return False
             
+            key_future = None
+            if password is not None:
+                # Derive the key while the Tor connection is being set up
+                salt = os.urandom(SALT_SIZE)
+                iv = os.urandom(IV_SIZE)
+                executor = ThreadPoolExecutor(max_workers=1)
+                key_future = executor.submit(self.encryptor.derive_key, password, salt)
+                executor.shutdown(wait=False)
+            
             # Connect to target
             sock = self.tor_client.create_socket()
             if not sock:
@@ -45,7 +73,16 @@ class P2PTransfer:
                 'action': 'send_file'
             }
             
-            sock.send(json.dumps(metadata_dict).encode() + b'\n')
+            # Salt and IV travel in the metadata and the GCM tag in a final
+            # frame, so the receiver can decrypt chunks as they arrive
+            if password is not None:
+                metadata_dict.update({
+                    'filename': f"{metadata.filename}.encrypted",
+                    'salt': salt.hex(),
+                    'iv': iv.hex()
+                })
+            
+            sock.sendall(orjson.dumps(metadata_dict) + b'\n')
             
             # Wait for acknowledgment
             ack = sock.recv(1024).decode().strip()
@@ -54,38 +91,24 @@ class P2PTransfer:
                 sock.close()
                 return False
             
-            # Send file in chunks with progress bar
-            with tqdm(total=metadata.filesize, unit='B', unit_scale=True, 
-                     desc=f"Sending {metadata.filename}") as pbar:
+            # Stream framed chunks back-to-back; the receiver only acknowledges
+            # once at the end, so no per-chunk round-trip over Tor
+            with open(file_path, 'rb') as f, \
+                 tqdm(total=metadata.filesize, unit='B', unit_scale=True, 
+                      desc=f"Sending {metadata.filename}") as pbar:
                 
-                for chunk_index in range(metadata.chunks):
-                    chunk_data = self.file_handler.read_chunk(file_path, chunk_index)
-                    if not chunk_data:
-                        print(f"Failed to read chunk {chunk_index}")
-                        sock.close()
-                        return False
-                    
-                    # Send chunk index and data
-                    chunk_info = {
-                        'index': chunk_index,
-                        'size': len(chunk_data),
-                        'final': chunk_index == metadata.chunks - 1
-                    }
-                    
-                    sock.send(json.dumps(chunk_info).encode() + b'\n')
-                    sock.send(chunk_data)
-                    
-                    # Wait for chunk acknowledgment
-                    chunk_ack = sock.recv(1024).decode().strip()
-                    if chunk_ack != f'CHUNK_{chunk_index}_OK':
-                        print(f"Chunk {chunk_index} failed")
-                        sock.close()
-                        return False
-                    
-                    pbar.update(len(chunk_data))
+                if key_future is None:
+                    sent = self._send_chunks(sock, f, metadata, pbar)
+                else:
+                    encryptor = self.encryptor.create_encryptor(key_future.result(), iv)
+                    sent = self._send_encrypted_chunks(sock, f, metadata, encryptor, pbar)
+            
+            if not sent:
+                sock.close()
+                return False
             
             # Verify transfer completion
-            sock.send(b'TRANSFER_COMPLETE\n')
+            sock.sendall(b'TRANSFER_COMPLETE\n')
             final_ack = sock.recv(1024).decode().strip()
             
             sock.close()
@@ -101,136 +124,325 @@ class P2PTransfer:
             print(f"Error sending file: {e}")
             return False
     
-    def start_receiver(self, port: int, download_dir: str = "./downloads",
-                      on_file_received: Callable = None) -> bool:
-        """Start listening for incoming file transfers"""
+    def _send_chunks(self, sock: socket.socket, f, metadata: FileMetadata,
+                     pbar: tqdm) -> bool:
+        """Send file chunks as-is using in-kernel sendfile()"""
+        # Header and payload come from separate syscalls; corking lets the
+        # kernel coalesce them into full segments (Linux only)
+        cork = hasattr(socket, 'TCP_CORK')
+        if cork:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
         try:
-            # Create listening socket
-            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            listener.bind(('0.0.0.0', port))
-            listener.listen(5)
-            
-            self.is_listening = True
-            print(f"Listening for incoming connections on port {port}...")
-            
-            while self.is_listening:
-                try:
-                    client_sock, addr = listener.accept()
-                    print(f"Connection from {addr}")
-                    
-                    # Handle client in separate thread
-                    thread = threading.Thread(
-                        target=self._handle_client,
-                        args=(client_sock, download_dir, on_file_received)
-                    )
-                    thread.daemon = True
-                    thread.start()
-                    
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    print(f"Error accepting connection: {e}")
+            for chunk_index in range(metadata.chunks):
+                offset = chunk_index * metadata.chunk_size
+                count = min(metadata.chunk_size, metadata.filesize - offset)
+                flags = FLAG_FINAL if chunk_index == metadata.chunks - 1 else 0
+                sock.sendall(CHUNK_HEADER.pack(chunk_index, count, flags))
+                if sock.sendfile(f, offset, count) != count:
+                    print(f"Failed to send chunk {chunk_index}")
+                    return False
+                
+                pbar.update(count)
+        finally:
+            if cork:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+        
+        return True
+    
+    def _send_encrypted_chunks(self, sock: socket.socket, f, metadata: FileMetadata,
+                               encryptor, pbar: tqdm) -> bool:
+        """Encrypt file chunks straight into the socket, then send the tag"""
+        in_view = memoryview(bytearray(metadata.chunk_size))
+        out_buf = bytearray(metadata.chunk_size + 15)
+        out_view = memoryview(out_buf)
+        
+        for chunk_index in range(metadata.chunks):
+            count = min(metadata.chunk_size,
+                        metadata.filesize - chunk_index * metadata.chunk_size)
+            if f.readinto(in_view[:count]) != count:
+                print(f"Failed to read chunk {chunk_index}")
+                return False
             
-            listener.close()
+            encryptor.update_into(in_view[:count], out_buf)
+            flags = FLAG_FINAL if chunk_index == metadata.chunks - 1 else 0
+            self._send_frame(sock, CHUNK_HEADER.pack(chunk_index, count, flags),
+                             out_view[:count])
+            pbar.update(count)
+        
+        encryptor.finalize()
+        sock.sendall(CHUNK_HEADER.pack(0, TAG_SIZE, FLAG_TAG) + encryptor.tag)
+        return True
+    
+    def _send_frame(self, sock: socket.socket, header: bytes, payload) -> None:
+        """Send chunk header and payload together in one gathered write"""
+        if not hasattr(sock, 'sendmsg'):
+            sock.sendall(header)
+            sock.sendall(payload)
+            return
+        
+        buffers = [memoryview(header), memoryview(payload)]
+        while buffers:
+            sent = sock.sendmsg(buffers)
+            # Drop fully sent buffers and trim a partially sent one
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if buffers:
+                buffers[0] = buffers[0][sent:]
+    
+    def start_receiver(self, port: int, download_dir: str = "./downloads",
+                      on_file_received: Callable = None,
+                      password: Optional[str] = None) -> bool:
+        """Start listening for incoming file transfers
+        
+        With a password, encrypted files are decrypted while they are received.
+        """
+        try:
+            asyncio.run(self._serve(port, download_dir, on_file_received, password))
             return True
             
         except Exception as e:
             print(f"Error starting receiver: {e}")
             return False
     
-    def _handle_client(self, sock: socket.socket, download_dir: str, 
-                      on_file_received: Callable = None):
+    async def _serve(self, port: int, download_dir: str,
+                     on_file_received: Callable, password: Optional[str]):
+        """Serve all connections from one event loop
+        
+        Disk writes, key derivation, decryption and hashing run on a small
+        worker pool instead of one thread per client.
+        """
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=WORKER_THREADS))
+        
+        server = await asyncio.start_server(
+            lambda reader, writer: self._handle_client(
+                reader, writer, download_dir, on_file_received, password),
+            '0.0.0.0', port, reuse_address=True)
+        
+        self.is_listening = True
+        print(f"Listening for incoming connections on port {port}...")
+        
+        async with server:
+            while self.is_listening:
+                await asyncio.sleep(0.5)
+    
+    async def _handle_client(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter, download_dir: str,
+                             on_file_received: Callable = None,
+                             password: Optional[str] = None):
         """Handle incoming client connection"""
+        print(f"Connection from {writer.get_extra_info('peername')}")
         try:
             # Receive metadata
-            metadata_data = b''
-            while b'\n' not in metadata_data:
-                chunk = sock.recv(1024)
-                if not chunk:
-                    return
-                metadata_data += chunk
+            metadata_line = await reader.readline()
+            if not metadata_line:
+                return
             
-            metadata = json.loads(metadata_data.decode().strip())
+            metadata = orjson.loads(metadata_line)
             
             if metadata.get('action') == 'send_file':
-                self._receive_file(sock, metadata, download_dir, on_file_received)
+                await self._receive_file(reader, writer, metadata, download_dir,
+                                         on_file_received, password)
             
         except Exception as e:
             print(f"Error handling client: {e}")
         finally:
-            sock.close()
+            writer.close()
     
-    def _receive_file(self, sock: socket.socket, metadata: dict, 
-                     download_dir: str, on_file_received: Callable):
+    async def _receive_file(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter, metadata: dict,
+                            download_dir: str, on_file_received: Callable,
+                            password: Optional[str] = None):
         """Receive file from sender"""
+        loop = asyncio.get_running_loop()
+        fd = None
+        decryptor = None
+        verified = False
         try:
             filename = metadata['filename']
             filesize = metadata['filesize']
-            total_chunks = metadata['chunks']
             expected_checksum = metadata['checksum']
+            encrypted = metadata.get('encrypted', False)
+            
+            file_header = b''
+            if encrypted:
+                salt = bytes.fromhex(metadata['salt'])
+                iv = bytes.fromhex(metadata['iv'])
+                if password:
+                    # Decrypt chunks as they arrive instead of storing ciphertext
+                    key = await loop.run_in_executor(
+                        None, self.encryptor.derive_key, password, salt)
+                    decryptor = self.encryptor.create_decryptor(key, iv)
+                    if filename.endswith('.encrypted'):
+                        filename = filename[:-len('.encrypted')]
+                else:
+                    # Store in the layout produced by FileEncryptor.encrypt_file
+                    file_header = salt + iv
             
             output_path = os.path.join(download_dir, filename)
+            output_size = filesize
+            if file_header:
+                output_size += len(file_header) + TAG_SIZE
+            
+            # Chunk offsets are derived from the index on both sides
+            chunk_size = self.file_handler.chunk_size
+            if metadata.get('chunk_size') != chunk_size:
+                print(f"Unsupported chunk size: {metadata.get('chunk_size')}")
+                writer.write(b'NOT_READY\n')
+                await writer.drain()
+                return
+            
+            # Single descriptor for the whole transfer; chunks are placed
+            # with pwrite() so plaintext chunks may arrive in any order
+            fd = await loop.run_in_executor(
+                None, self.file_handler.open_output, output_path, output_size)
+            if fd is None:
+                writer.write(b'NOT_READY\n')
+                await writer.drain()
+                return
+            if file_header:
+                os.pwrite(fd, file_header, 0)
             
             # Send ready signal
-            sock.send(b'READY\n')
+            writer.write(b'READY\n')
+            await writer.drain()
             
             # Create progress bar
             with tqdm(total=filesize, unit='B', unit_scale=True,
                      desc=f"Receiving {filename}") as pbar:
                 
-                received_chunks = 0
-                while received_chunks < total_chunks:
-                    # Receive chunk info
-                    chunk_info_data = b''
-                    while b'\n' not in chunk_info_data:
-                        chunk = sock.recv(1024)
-                        if not chunk:
+                # Writes run on the worker pool so disk I/O overlaps with
+                # the network; at most WRITE_QUEUE_SIZE are outstanding
+                pending = set()
+                write_failed = False
+                received = 0
+                try:
+                    while received < filesize and not write_failed:
+                        # Receive fixed-size chunk header
+                        header = await self._read_exactly(reader, CHUNK_HEADER.size)
+                        if header is None:
                             break
-                        chunk_info_data += chunk
-                    
-                    if not chunk_info_data:
-                        break
-                    
-                    chunk_info = json.loads(chunk_info_data.decode().strip())
-                    chunk_index = chunk_info['index']
-                    chunk_size = chunk_info['size']
-                    is_final = chunk_info.get('final', False)
-                    
-                    # Receive chunk data
-                    chunk_data = b''
-                    while len(chunk_data) < chunk_size:
-                        remaining = chunk_size - len(chunk_data)
-                        data = sock.recv(min(4096, remaining))
-                        if not data:
+                        chunk_index, size, flags = CHUNK_HEADER.unpack(header)
+                        if size > chunk_size or \
+                           chunk_index * chunk_size + size > filesize:
+                            print(f"Invalid header for chunk {chunk_index}")
                             break
-                        chunk_data += data
-                    
-                    # Write chunk
-                    if self.file_handler.write_chunk(output_path, chunk_index, chunk_data):
-                        sock.send(f'CHUNK_{chunk_index}_OK\n'.encode())
-                        received_chunks += 1
-                        pbar.update(len(chunk_data))
-                    else:
-                        sock.send(f'CHUNK_{chunk_index}_FAIL\n'.encode())
-                        break
+                        # Receiving stops once filesize bytes are in; the final
+                        # flag is only checked against the chunk's position
+                        if flags & FLAG_FINAL and \
+                           chunk_index * chunk_size + size != filesize:
+                            print(f"Unexpected final flag on chunk {chunk_index}")
+                            break
+                        # The GCM tag only covers the ciphertext stream, not
+                        # the headers, so decrypted chunks must arrive in order
+                        if decryptor and chunk_index != received // chunk_size:
+                            print(f"Out-of-order chunk {chunk_index} in encrypted transfer")
+                            break
+                        
+                        # Receive chunk data, decrypting on the way when a
+                        # password was given
+                        chunk_data = await self._read_exactly(reader, size)
+                        if chunk_data is None:
+                            break
+                        if decryptor:
+                            chunk_data = await loop.run_in_executor(
+                                None, decryptor.update, chunk_data)
+                        
+                        pending.add(loop.run_in_executor(
+                            None, self.file_handler.write_chunk,
+                            fd, chunk_index, chunk_data, len(file_header)))
+                        if len(pending) >= WRITE_QUEUE_SIZE:
+                            done, pending = await asyncio.wait(
+                                pending, return_when=asyncio.FIRST_COMPLETED)
+                            write_failed = not all(task.result() for task in done)
+                        
+                        received += size
+                        pbar.update(size)
+                finally:
+                    # Wait for all outstanding chunks to hit the disk
+                    if pending:
+                        done, _ = await asyncio.wait(pending)
+                        if not all(task.result() for task in done):
+                            write_failed = True
+                
+                # Encrypted payloads are followed by the authentication tag
+                tag = None
+                if encrypted and received == filesize:
+                    tag = await self._recv_tag(reader)
                 
-                # Check for transfer completion
-                completion_data = sock.recv(1024).decode().strip()
-                if completion_data == 'TRANSFER_COMPLETE':
-                    # Verify file
-                    actual_checksum = self.file_handler._calculate_checksum(output_path)
-                    if actual_checksum == expected_checksum:
-                        sock.send(b'SUCCESS\n')
+                # Check for transfer completion; after an aborted receive
+                # the stream position is unknown, so don't parse further
+                completion_data = ''
+                if received == filesize:
+                    completion_data = (await reader.readline()).decode(errors='replace').strip()
+                if completion_data == 'TRANSFER_COMPLETE' and received == filesize \
+                        and not write_failed and (tag or not encrypted):
+                    if decryptor:
+                        # GCM tag authenticates the whole decrypted stream
+                        try:
+                            decryptor.finalize_with_tag(tag)
+                            verified = True
+                        except InvalidTag:
+                            verified = False
+                    else:
+                        if file_header:
+                            os.pwrite(fd, tag, len(file_header) + filesize)
+                        
+                        # Verify file; only encrypted files may omit the
+                        # checksum, as their tag is checked on decryption
+                        if expected_checksum is None:
+                            verified = encrypted
+                        else:
+                            verified = await loop.run_in_executor(
+                                None, self.file_handler._calculate_checksum,
+                                output_path) == expected_checksum
+                    
+                    if verified:
+                        # One durable flush for the whole file before
+                        # telling the sender it has been stored
+                        await loop.run_in_executor(None, os.fsync, fd)
+                        writer.write(b'SUCCESS\n')
                         print(f"File received successfully: {output_path}")
                         
                         if on_file_received:
+                            metadata['decrypted'] = decryptor is not None
                             on_file_received(output_path, metadata)
+                    elif decryptor:
+                        writer.write(b'AUTHENTICATION_FAILED\n')
+                        print("File authentication failed!")
                     else:
-                        sock.send(b'CHECKSUM_MISMATCH\n')
+                        writer.write(b'CHECKSUM_MISMATCH\n')
                         print("File checksum mismatch!")
                 else:
-                    sock.send(b'TRANSFER_INCOMPLETE\n')
+                    writer.write(b'TRANSFER_INCOMPLETE\n')
+                await writer.drain()
                     
         except Exception as e:
             print(f"Error receiving file: {e}")
+        finally:
+            if fd is not None:
+                os.close(fd)
+                # Never leave unauthenticated plaintext behind, whether the
+                # tag failed, the transfer was cut short or an error occurred
+                if decryptor and not verified:
+                    os.remove(output_path)
+    
+    async def _recv_tag(self, reader: asyncio.StreamReader) -> Optional[bytes]:
+        """Receive the trailing authentication tag frame"""
+        header = await self._read_exactly(reader, CHUNK_HEADER.size)
+        if header is None:
+            return None
+        _, size, flags = CHUNK_HEADER.unpack(header)
+        if not flags & FLAG_TAG or size != TAG_SIZE:
+            return None
+        
+        return await self._read_exactly(reader, TAG_SIZE)
+    
+    async def _read_exactly(self, reader: asyncio.StreamReader,
+                            size: int) -> Optional[bytes]:
+        """Read exactly size bytes, None if the peer closed early"""
+        try:
+            return await reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            return None
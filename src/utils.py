@@ -1,12 +1,30 @@
 import os
+import time
 import hashlib
-import json
+import orjson
 from typing import Dict, Any
 
 def ensure_dir(directory: str):
     """Ensure directory exists"""
     os.makedirs(directory, exist_ok=True)
 
+def file_sha256(file_path: str) -> str:
+    """Calculate SHA-256 checksum of file"""
+    with open(file_path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            # Python 3.11+: hashing loop runs entirely in C
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        
+        sha256_hash = hashlib.sha256()
+        buf = bytearray(1024 * 1024)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            sha256_hash.update(view[:n])
+        return sha256_hash.hexdigest()
+
 def human_readable_size(size: int) -> str:
     """Convert bytes to human readable format"""
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -16,26 +34,21 @@ def human_readable_size(size: int) -> str:
     return f"{size:.2f} PB"
 
 def save_transfer_log(metadata: Dict[str, Any], log_dir: str = "./logs"):
-    """Save transfer metadata to log file"""
+    """Append transfer metadata to the JSON Lines log file"""
     ensure_dir(log_dir)
-    log_file = os.path.join(log_dir, "transfers.json")
+    log_file = os.path.join(log_dir, "transfers.jsonl")
     
     try:
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as f:
-                logs = json.load(f)
-        else:
-            logs = []
-        
-        logs.append({
+        record = {
             'timestamp': time.time(),
             'filename': metadata.get('filename'),
             'filesize': metadata.get('filesize'),
             'checksum': metadata.get('checksum'),
             'encrypted': metadata.get('encrypted', False)
-        })
+        }
         
-        with open(log_file, 'w') as f:
-            json.dump(logs, f, indent=2)
+        # One record per line, so logging never rereads earlier transfers
+        with open(log_file, 'ab') as f:
+            f.write(orjson.dumps(record) + b'\n')
     except Exception as e:
         print(f"Error saving transfer log: {e}")